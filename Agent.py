@@ -1,5 +1,231 @@
+import random
+import time
+from dataclasses import dataclass
+
 import numpy as np
 
+# deepest iteration of the minimax search, in plies
+MAX_DEPTH = 5
+
+# score of a won game, from the winner's point of view
+WIN_SCORE = 1000000000
+
+# half width of the aspiration window searched around the previous iteration's score
+ASPIRATION_WINDOW = 50
+
+# most positions kept in an agent's transposition table, the shallowest entries are evicted when it is full
+TT_SIZE = 1 << 20
+
+# entries left in a full transposition table after eviction, freeing a quarter of it at once keeps evictions rare
+TT_LOW_WATER = TT_SIZE * 3 // 4
+
+# transposition table entry flags, whether the stored score is exact or only a lower or upper bound
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+
+# number of set bits in every possible byte, for counting bits on NumPy versions without np.bitwise_count
+BYTE_POPCOUNTS = np.array([bin(byte).count('1') for byte in range(256)], dtype=np.uint8)
+
+
+def popcount(values):
+    """
+    Counts the set bits of every element of a uint64 array. np.bitwise_count does this in one call but only exists
+    from NumPy 2.0 on, older versions look up the count of each of the 8 bytes of every element and add them up
+
+    :param values: 1D NumPy uint64 array
+    :return: 1D NumPy array with the number of set bits in each element
+    """
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(values)
+    return BYTE_POPCOUNTS[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def window_masks(n_rows, n_cols, n_to_win):
+    """
+    Builds the bitboard masks of every window of n_to_win consecutive positions on the board
+
+    :param n_rows: number of rows in the game's board
+    :param n_cols: number of cols in the game's board
+    :param n_to_win: number of consecutive pieces required for a win
+    :return: tuple of integer masks, one per horizontal, vertical, and diagonal window
+    """
+    column_height = n_rows + 1  # one spare bit on top of every column, see Board
+    masks = []
+    # (column step, row step) for horizontal, vertical, bottom up diagonal, top down diagonal
+    for d_col, d_row in ((1, 0), (0, 1), (1, 1), (1, -1)):
+        for column in range(n_cols):
+            for row in range(n_rows):
+                last_col = column + (n_to_win - 1) * d_col
+                last_row = row + (n_to_win - 1) * d_row
+                if last_col >= n_cols or last_row < 0 or last_row >= n_rows:
+                    continue
+                mask = 0
+                for i in range(n_to_win):
+                    mask |= 1 << ((column + i * d_col) * column_height + row + i * d_row)
+                masks.append(mask)
+    return tuple(masks)
+
+
+def is_connected(bitboard, column_height, n_to_win):
+    """
+    Checks a single player's bitboard for n_to_win consecutive pieces in any direction
+
+    Shifting the bitboard by 1 moves every piece one row, by column_height one column, and by column_height -/+ 1
+    along the diagonals. ANDing the shifted copies together leaves a bit set only where a full streak starts.
+
+    :param bitboard: integer - bitboard of one player's pieces
+    :param column_height: integer - number of bits used per column of the bitboard
+    :param n_to_win: number of consecutive pieces required for a win
+    :return: True if the bitboard contains a winning streak, False otherwise
+    """
+    for shift in (1, column_height, column_height - 1, column_height + 1):
+        streak = bitboard
+        for i in range(1, n_to_win):
+            streak &= bitboard >> (i * shift)
+        if streak:
+            return True
+    return False
+
+
+def is_connected_6x7x4(bitboard):
+    """
+    is_connected specialized for the default 6x7 board with 4 to win. The shifts are constants, and each streak of 4
+    takes two shift-ANDs: the first leaves a bit where a pair starts, the second where two pairs back to back start
+
+    :param bitboard: integer - bitboard of one player's pieces on a 6x7 board
+    :return: True if the bitboard contains a winning streak, False otherwise
+    """
+    streak = bitboard & (bitboard >> 1)  # vertical
+    if streak & (streak >> 2):
+        return True
+    streak = bitboard & (bitboard >> 7)  # horizontal
+    if streak & (streak >> 14):
+        return True
+    streak = bitboard & (bitboard >> 6)  # top down diagonal
+    if streak & (streak >> 12):
+        return True
+    streak = bitboard & (bitboard >> 8)  # bottom up diagonal
+    if streak & (streak >> 16):
+        return True
+    return False
+
+
+def winning_squares_6x7x4(bitboard):
+    """
+    Finds every square, filled or not, that would complete a streak of 4 for one player on the default 6x7 board.
+    For each direction the square can be at either end of a streak or one of the two middle spots, and each case is
+    a few shift-ANDs of the bitboard, so all squares are found at once
+
+    :param bitboard: integer - bitboard of one player's pieces on a 6x7 board
+    :return: integer - bitboard of the squares that would give the player 4 in a row
+    """
+    squares = (bitboard << 1) & (bitboard << 2) & (bitboard << 3)  # vertical, only ever on top of a streak
+    for shift in (7, 6, 8):  # horizontal, top down diagonal, bottom up diagonal
+        pair = (bitboard << shift) & (bitboard << (2 * shift))
+        squares |= pair & (bitboard << (3 * shift))
+        squares |= pair & (bitboard >> shift)
+        pair = (bitboard >> shift) & (bitboard >> (2 * shift))
+        squares |= pair & (bitboard >> (3 * shift))
+        squares |= pair & (bitboard << shift)
+    return squares
+
+
+@dataclass
+class Board:
+    """
+    Bitboard representation of a game board
+
+    Each column takes n_rows + 1 bits, with the bottom row at the lowest bit. The spare bit on top of every column
+    stays empty so that shifted streaks never wrap from the top of one column into the bottom of the next.
+
+    Attributes
+    ------------
+    p1: integer - bitboard of player 1's pieces
+    p2: integer - bitboard of player 2's pieces
+    heights: list of integers - number of pieces in each column, also the row index of the next open bit
+    n_rows: number of rows in the game's board
+    n_open: integer - number of open positions remaining on the board
+    """
+
+    p1: int
+    p2: int
+    heights: list
+    n_rows: int
+    n_open: int
+
+    @classmethod
+    def from_array(cls, board):
+        """
+        Builds the bitboards from a 2D array board, as stored by the Connect4 game
+
+        :param board: 2D NumPy array showing status of each board position, row 0 is the top row
+        :return: Board with the same pieces
+        """
+        n_rows, n_cols = board.shape
+        position = cls(0, 0, [0] * n_cols, n_rows, n_rows * n_cols)
+        for col in range(n_cols):
+            for row in range(n_rows - 1, -1, -1):  # bottom to top, note that row n_rows - 1 is the bottom row
+                if board[row, col] == 0:
+                    break
+                position.play(col, board[row, col])
+        return position
+
+    def pieces(self, player):
+        """
+        :param player: integer - 1 or 2
+        :return: bitboard of the designated player's pieces
+        """
+        if player == 1:
+            return self.p1
+        else:
+            return self.p2
+
+    def play(self, col, player):
+        """
+        Drops a piece for the designated player in the designated column. Column assumed to have room.
+
+        :param col: integer - column to place player's piece
+        :param player: integer - 1 or 2
+        :return: None
+        """
+        bit = 1 << (col * (self.n_rows + 1) + self.heights[col])
+        if player == 1:
+            self.p1 |= bit
+        else:
+            self.p2 |= bit
+        self.heights[col] += 1
+        self.n_open -= 1
+
+    def undo(self, col, player):
+        """
+        Takes the designated player's piece back off the top of the designated column, reversing play
+
+        :param col: integer - column the piece was played in
+        :param player: integer - 1 or 2
+        :return: None
+        """
+        self.heights[col] -= 1
+        self.n_open += 1
+        bit = 1 << (col * (self.n_rows + 1) + self.heights[col])
+        if player == 1:
+            self.p1 ^= bit
+        else:
+            self.p2 ^= bit
+
+    def clear(self):
+        """
+        Takes every piece off the board, keeping the same heights list
+
+        :return: None
+        """
+        self.p1 = 0
+        self.p2 = 0
+        for col in range(len(self.heights)):
+            self.heights[col] = 0
+        self.n_open = self.n_rows * len(self.heights)
+
 
 class Agent:
     """
@@ -10,6 +236,19 @@ class Agent:
     player: integer - 1 or 2, represents which player the agent is
     n_rows_board: number of rows in the game's board
     n_cols_board: number of cols in the game's board
+    is_default_shape: boolean - True on the default 6x7 board with 4 to win, which has specialized win detection
+    opponent_of: tuple of integers - opponent of player 1 at index 1 and of player 2 at index 2
+    mask_array: 1D NumPy uint64 array - bitboard masks of every n_to_win window on the board
+    chunk_scores: 1D NumPy array - evaluate_chunk score of a window, indexed by n_player * (n_to_win + 1) + n_opponent
+    bottom_mask: integer - bitboard mask of the bottom square of every column
+    board_mask: integer - bitboard mask of every square on the board, leaving out the spare bit on top of each column
+    center_mask: integer - bitboard mask of the center column
+    zobrist: list of lists of integers - random key per player per bitboard bit, XORed together to hash a board
+    transposition_table: dict - zobrist hash -> (searched depth, score, flag, best column) of positions searched
+    column_order: list of integers - columns from the center outwards, the order moves are tried in
+    killers: list of lists of integers - per depth, the two columns that most recently caused a cutoff
+    deadline: float - time.monotonic() time at which a running search is abandoned, None for no limit
+    out_of_time: boolean - True once the running search has passed its deadline
     """
 
     def __init__(self, ai_player, n_rows_board=6, n_cols_board=7, n_to_win=4):
@@ -26,89 +265,75 @@ class Agent:
         self.n_rows_board = n_rows_board
         self.n_cols_board = n_cols_board
         self.n_to_win = n_to_win
+        self.is_default_shape = (n_rows_board, n_cols_board, n_to_win) == (6, 7, 4)
+        self.opponent_of = (0, 2, 1)  # index 0 unused, spares a branch on every lookup
+        if n_cols_board * (n_rows_board + 1) > 64:
+            raise ValueError("a %dx%d board does not fit in a 64 bit bitboard" % (n_rows_board, n_cols_board))
+        self.mask_array = np.array(window_masks(n_rows_board, n_cols_board, n_to_win), dtype=np.uint64)
+        self.chunk_scores = np.array([self.evaluate_chunk(n_player, n_opponent)
+                                      for n_player in range(n_to_win + 1) for n_opponent in range(n_to_win + 1)])
+        self.bottom_mask = sum(1 << (col * (n_rows_board + 1)) for col in range(n_cols_board))
+        self.board_mask = self.bottom_mask * ((1 << n_rows_board) - 1)
+        self.center_mask = ((1 << n_rows_board) - 1) << (n_cols_board // 2 * (n_rows_board + 1))
+        n_bits = n_cols_board * (n_rows_board + 1)
+        self.zobrist = np.random.SeedSequence(0).generate_state(2 * n_bits, dtype=np.uint64).reshape(2, n_bits).tolist()
+        self.transposition_table = {}
+        self.column_order = sorted(range(n_cols_board), key=lambda col: abs(col - n_cols_board // 2))
+        self.killers = [[-1, -1] for _ in range(MAX_DEPTH + 1)]
+        self.deadline = None
+        self.out_of_time = False
 
     def is_valid_move(self, col, board):
         """
         Determine if a move in a given column is valid. Returns None or row
 
         :param col: integer - requested column
-        :param board - 2D NumPy array showing status of each board position
-        :return: row number for correct move if move would be valid, None otherwise
+        :param board: Board showing status of each board position
+        :return: row number (counted from the bottom) for correct move if move would be valid, None otherwise
         """
         rv = None
-        for row in range(self.n_rows_board - 1, -1, -1):  # note that row 5 is the bottom row
-            if board[row, col] == 0:
-                rv = row
-                break
-        return rv
-
-    def check_segment_for_winner(self, segment, player):
-        """
-        Checks a given segment of n_to_win size pieces for a win by designated player
-
-        :param player: integer - player checking for winning pieces
-        :param segment: 1d NumPy array representing the game pieces on a particular board segment
-        :return: True if player won, False otherwise
-        """
-
-        # convert the ndarray to a list because the list class actually has better methods
-        # for counting occurrences of specific values. It could be done in numpy but it would
-        # be much less readable and we're not doing math so it seems acceptable
-        segment_list = segment.tolist()
-
-        if segment_list.count(player) == self.n_to_win:
-            rv = True
-        else:
-            rv = False
-
+        if board.heights[col] < self.n_rows_board:
+            rv = board.heights[col]
         return rv
 
     def is_winning_state(self, board, player):
         """
         Check a given board state for a win by designated player
         :param player: integer - player checking for winning pieces
-        :param board: 2d NumPy array representing the board
+        :param board: Board representing the board
         :return: True if player has won, False otherwise
         """
+        if self.is_default_shape:
+            return is_connected_6x7x4(board.pieces(player))
+        return is_connected(board.pieces(player), self.n_rows_board + 1, self.n_to_win)
 
-        # evaluate in the horizontal direction
-        for row in range(self.n_rows_board):
-            for column in range(self.n_cols_board - self.n_to_win + 1):  # note indexing stops with space to check
-                segment = board[row, column:column + self.n_to_win]
-                win_occurred = self.check_segment_for_winner(segment, player)
-                if win_occurred:
-                    return True
-
-        # evaluate in the vertical direction
-        for column in range(self.n_cols_board):
-            for row in range(self.n_rows_board - self.n_to_win + 1):  # note indexing again
-                segment = board[row:row + self.n_to_win, column]
-                win_occurred = self.check_segment_for_winner(segment, player)
-                if win_occurred:
-                    return True
-
-        # top down diagonals
-        for row in range(self.n_rows_board - self.n_to_win + 1):
-            for column in range(self.n_cols_board - self.n_to_win + 1):
-                segment = np.array([board[row, column], board[row + 1, column + 1], board[row + 2, column + 2],
-                                    board[row + 3, column + 3]])
-                win_occurred = self.check_segment_for_winner(segment, player)
-                if win_occurred:
-                    return True
-
-        # bottom up diagonals
-        for row in range(self.n_rows_board - 1, self.n_to_win - 2, -1):
-            for column in range(self.n_cols_board - self.n_to_win + 1):
-                segment = np.array([board[row, column], board[row - 1, column + 1], board[row - 2, column + 2],
-                                    board[row - 3, column + 3]])
-                win_occurred = self.check_segment_for_winner(segment, player)
-                if win_occurred:
-                    return True
-
-        # if here no win has occurred
-        return False
-
-    def evaluate_chunk(self, chunk, player):
+    def winning_moves(self, board, player):
+        """
+        :param board: Board to check
+        :param player: integer - player to move
+        :return: list of the columns in which a piece for the designated player would complete a win
+        """
+        bitboard = board.pieces(player)
+        column_height = self.n_rows_board + 1
+        if self.is_default_shape:
+            # adding the bottom bit of every column to the occupied squares carries into the lowest open square
+            playable = ((board.p1 | board.p2) + self.bottom_mask) & self.board_mask
+            squares = winning_squares_6x7x4(bitboard) & playable
+            winning = []
+            while squares:
+                square = squares & -squares
+                winning.append((square.bit_length() - 1) // column_height)
+                squares ^= square
+            return winning
+        winning = []
+        for col in range(self.n_cols_board):
+            if board.heights[col] < self.n_rows_board:
+                trial = bitboard | (1 << (col * column_height + board.heights[col]))
+                if is_connected(trial, column_height, self.n_to_win):
+                    winning.append(col)
+        return winning
+
+    def evaluate_chunk(self, n_player, n_opponent):
         # each chunk is size n_to_win, so positions worth giving a score to, from best to worst are
         # player has all n_to_win spots in this chunk
         # player has n_to_win - 1 spots in this chunk but the remaining spot is open
@@ -117,153 +342,289 @@ class Agent:
         # opponent has n_to_win - 1 spots in this chunk but the remaining spot is open
         # opponent has all n_to_win spots in this chunk
 
-        # convert the ndarray to a list because the list class actually has better methods
-        # for counting occurrences of specific values. It could be done in numpy but it would
-        # be much less readable and we're not doing math so it seems acceptable
-        chunk_list = chunk.tolist()
+        # the chunk is described by how many of its spots each player holds, the rest are open
+        n_open = self.n_to_win - n_player - n_opponent
         score_this_chunk = 0
-        if player == 1:
-            opponent = 2
-        else:
-            opponent = 1
 
-        if chunk_list.count(player) == self.n_to_win:
+        if n_player == self.n_to_win:
             score_this_chunk = 100
-        elif chunk_list.count(player) == self.n_to_win - 1 and chunk_list.count(0) == 1:
+        elif n_player == self.n_to_win - 1 and n_open == 1:
             score_this_chunk = 5
-        elif chunk_list.count(player) == self.n_to_win - 2 and chunk_list.count(0) == 2:
+        elif n_player == self.n_to_win - 2 and n_open == 2:
             score_this_chunk = 2
-        elif chunk_list.count(opponent) == self.n_to_win - 1 and chunk_list.count(0) == 1:
+        elif n_opponent == self.n_to_win - 1 and n_open == 1:
             score_this_chunk = -4
 
         return score_this_chunk
 
     def evaluate(self, board, player):
-        # for every row, score n_to_win positions at a time
-        # previous eval fx did not take into account whether or not is was possible get a sufficient streak
-        # from any given streak of 2 or 3 (ie scored the same even if the pieces were blocked from winning on both
-        # sides)
-        # this method will now look at each n_to_win sized position and tally a score considering
-        # both players' positions as well as open positions
+        # score every n_to_win sized window on the board, considering both players' positions as well as open
+        # positions. the windows are precomputed bitboard masks, so the pieces each player holds in every window are
+        # the popcounts of their bitboard ANDed with the mask array, all in one vectorized pass
 
-        score = 0
-        center = board[:, self.n_cols_board//2].tolist()
-        score += center.count(player) * 3
-
-        # evaluate in the horizontal direction
-        for row in range(self.n_rows_board):
-            for column in range(self.n_cols_board - self.n_to_win + 1):  # note indexing stops with space to check
-                chunk = board[row, column:column + self.n_to_win]
-                score += self.evaluate_chunk(chunk, player)
-
-        # evaluate in the vertical direction
-        for column in range(self.n_cols_board):
-            for row in range(self.n_rows_board - self.n_to_win + 1):  # note indexing again
-                chunk = board[row:row + self.n_to_win, column]
-                score += self.evaluate_chunk(chunk, player)
-
-        # top down diagonals
-        for row in range(self.n_rows_board - self.n_to_win + 1):
-            for column in range(self.n_cols_board - self.n_to_win + 1):
-                chunk = np.array([board[row, column], board[row + 1, column + 1], board[row + 2, column + 2],
-                                  board[row + 3, column + 3]])
-                score += self.evaluate_chunk(chunk, player)
-
-        # bottom up diagonals
-        for row in range(self.n_rows_board - 1, self.n_to_win - 2, -1):
-            for column in range(self.n_cols_board - self.n_to_win + 1):
-                chunk = np.array([board[row, column], board[row - 1, column + 1], board[row - 2, column + 2],
-                                  board[row - 3, column + 3]])
-                score += self.evaluate_chunk(chunk, player)
+        opponent = self.opponent_of[player]
+        own = board.pieces(player)
+        other = board.pieces(opponent)
+
+        score = (own & self.center_mask).bit_count() * 3
+
+        # the counts come back as uint8, widen them so the table index can't wrap around on large n_to_win
+        n_player = popcount(self.mask_array & np.uint64(own)).astype(np.intp)
+        n_opponent = popcount(self.mask_array & np.uint64(other)).astype(np.intp)
+        score += int(self.chunk_scores[n_player * (self.n_to_win + 1) + n_opponent].sum())
 
         return score
 
-    def is_terminal_state(self, board_state):
-        rv = False
-        if self.player == 1:
-            opponent = 2
+    def classify_state(self, board_state, last_player):
+        """
+        Determines whether the game is over and who, if anyone, won. Only the player who made the last move can have
+        just won, so only their pieces are checked
+
+        :param board_state: Board to classify
+        :param last_player: integer - player who made the last move on the board
+        :return: (terminal, winner) - True if the game is over, and the winning player or 0 if there is none
+        """
+        if self.is_winning_state(board_state, last_player):
+            return True, last_player
+        elif board_state.n_open == 0:  # board is full
+            return True, 0
         else:
-            opponent = 1
+            return False, 0
 
-        if self.is_winning_state(board_state, self.player) or self.is_winning_state(board_state, opponent) \
-                or not np.any(board_state == 0):
-            rv = True
-        return rv
+    def hash_board(self, board):
+        """
+        Computes the Zobrist hash of a board from scratch. minimax updates it incrementally from there
 
-    def minimax(self, board_state, current_depth, player, alpha, beta, n_nodes):
-        max_depth = 5
-        if self.is_terminal_state(board_state) is True or current_depth == max_depth:
-            if self.is_terminal_state(board_state):
-                if self.player == 1:
-                    opponent = 2
-                else:
-                    opponent = 1
-                if self.is_winning_state(board_state, self.player):
-                    return 1000000000, -1, n_nodes + 1
-                elif self.is_winning_state(board_state, opponent):
-                    return -1000000000, -1, n_nodes + 1
-                else:  # board is full
-                    return 0, -1, n_nodes + 1
-            else:  # max depth reached
-                score = self.evaluate(board_state, self.player)
-                return score, -1, n_nodes + 1  # -1 is just a throwaway value
+        :param board: Board to hash
+        :return: integer - XOR of the zobrist keys of every piece on the board
+        """
+        key = 0
+        for player in (1, 2):
+            bitboard = board.pieces(player)
+            while bitboard:
+                lowest_bit = bitboard & -bitboard
+                key ^= self.zobrist[player - 1][lowest_bit.bit_length() - 1]
+                bitboard ^= lowest_bit
+        return key
+
+    def make_room_in_table(self):
+        """
+        Evicts the shallowest entries of the full transposition table, which were the cheapest to produce, until only
+        TT_LOW_WATER entries are left
+
+        :return: None
+        """
+        n_at_depth = {}
+        for entry in self.transposition_table.values():
+            n_at_depth[entry[0]] = n_at_depth.get(entry[0], 0) + 1
+
+        # keep whole depths from the deepest down while they fit, then as much of the next one as there is room for
+        keep_depth = max(n_at_depth) + 1
+        partial_depth = -1
+        n_kept = 0
+        for depth in sorted(n_at_depth, reverse=True):
+            if n_kept + n_at_depth[depth] > TT_LOW_WATER:
+                partial_depth = depth
+                break
+            n_kept += n_at_depth[depth]
+            keep_depth = depth
+        n_partial = TT_LOW_WATER - n_kept
+
+        kept = {}
+        for key, entry in self.transposition_table.items():
+            if entry[0] >= keep_depth:
+                kept[key] = entry
+            elif entry[0] == partial_depth and n_partial > 0:
+                kept[key] = entry
+                n_partial -= 1
+        self.transposition_table = kept
+
+    def choose_move(self, board, time_budget=None, max_depth=MAX_DEPTH):
+        """
+        Picks the agent's move by iterative deepening: minimax is run to depth 1, 2, ... max_depth, each iteration
+        leaving its results in the transposition table so the next, deeper one tries the best moves first
+
+        From depth 3 on each iteration first searches a narrow aspiration window around the previous score, and only
+        re-searches the full window if the score falls outside of it
+
+        :param board: Board to pick a move on, the agent is the player to move
+        :param time_budget: seconds after which the search stops, None to always reach max_depth. The depth 1
+            iteration always completes so there is a move to return, any later one still running is abandoned
+        :param max_depth: depth of the final iteration, in plies
+        :return: (score, column, n_nodes) of the deepest completed iteration, n_nodes summed over all iterations
+        """
+        start = time.monotonic()
+        # killers from the previous move are stale. there is a slot for every depth of this search as well as of a
+        # minimax called directly with the default max_depth afterwards
+        self.killers = [[-1, -1] for _ in range(max(max_depth, MAX_DEPTH) + 1)]
+        self.deadline = None
+        self.out_of_time = False
+        key = self.hash_board(board)
+        score = 0
+        column = -1
+        n_nodes = 0
+        for depth in range(1, max_depth + 1):
+            alpha = -np.inf
+            beta = np.inf
+            if depth >= 3:
+                alpha = score - ASPIRATION_WINDOW
+                beta = score + ASPIRATION_WINDOW
+            new_score, new_column, n_nodes = self.minimax(board, 0, self.player, alpha, beta, n_nodes, key, depth)
+            if not self.out_of_time and (new_score <= alpha or new_score >= beta):
+                # outside the aspiration window the score is only a bound
+                new_score, new_column, n_nodes = self.minimax(board, 0, self.player, -np.inf, np.inf, n_nodes, key,
+                                                              depth)
+            if self.out_of_time:  # the unfinished iteration's result is discarded
+                break
+            score = new_score
+            column = new_column
+
+            if abs(score) == WIN_SCORE:  # the outcome is decided, searching deeper won't change the move
+                break
+            if time_budget is not None:
+                self.deadline = start + time_budget
+                if time.monotonic() > self.deadline:
+                    break
+
+        self.deadline = None
+        return score, column, n_nodes
+
+    def minimax(self, board_state, current_depth, player, alpha, beta, n_nodes, key=None, max_depth=MAX_DEPTH):
+        if key is None:
+            key = self.hash_board(board_state)
+
+        next_player = self.opponent_of[player]
+
+        # the player to move next is the one who did not make the last move
+        terminal, winner = self.classify_state(board_state, next_player)
+        if terminal:
+            if winner == self.player:
+                return WIN_SCORE, -1, n_nodes + 1
+            elif winner != 0:
+                return -WIN_SCORE, -1, n_nodes + 1
+            else:  # board is full
+                return 0, -1, n_nodes + 1
+        elif current_depth == max_depth:
+            score = self.evaluate(board_state, self.player)
+            return score, -1, n_nodes + 1  # -1 is just a throwaway value
+
+        # past the deadline the iteration is abandoned, every call returns straight away and nothing more is stored
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            self.out_of_time = True
+        if self.out_of_time:
+            return 0, -1, n_nodes
+
+        # an earlier search of this position at least as deep as this one either answers it outright or narrows the
+        # window. either way its best move is the most likely to cause a cutoff, so it is tried first
+        remaining_depth = max_depth - current_depth
+        alpha_orig = alpha
+        beta_orig = beta
+        tt_move = -1
+        entry = self.transposition_table.get(key)
+        if entry is not None:
+            tt_depth, tt_score, tt_flag, tt_move = entry
+            if tt_depth >= remaining_depth:
+                if tt_flag == EXACT:
+                    return tt_score, tt_move, n_nodes + 1
+                elif tt_flag == LOWER:
+                    alpha = max(tt_score, alpha)
+                else:  # upper bound
+                    beta = min(tt_score, beta)
+                if alpha >= beta:
+                    return tt_score, tt_move, n_nodes + 1
+
+        # a player who can win on this move will, so there is nothing left to search
+        winning = self.winning_moves(board_state, player)
+        if winning:
+            if player == self.player:
+                return WIN_SCORE, winning[0], n_nodes + 1
+            return -WIN_SCORE, winning[0], n_nodes + 1
+
+        # move ordering: the transposition table move, then this depth's killer moves, then center out since the
+        # center columns take part in the most windows. the sooner a cutoff happens the fewer children get searched
+        killers = self.killers[current_depth]
+        column_order = []
+        for col in [tt_move] + killers + self.column_order:
+            if col != -1 and col not in column_order:
+                column_order.append(col)
 
         if current_depth % 2 == 1:
             is_min_node = True
         else:
             is_min_node = False
 
-        if player == 1:
-            next_player = 2
+        # track the best score so far and every column that reaches it, ties are broken at random at the end
+        if is_min_node:
+            best_score = np.inf
         else:
-            next_player = 1
-
-        column_list = []
-        score_list = []
+            best_score = -np.inf
+        best_columns = []
+        # a win for the player to move cannot be improved on, so it ends the search of this node like a cutoff does
+        if is_min_node:
+            mover_wins = -WIN_SCORE
+        else:
+            mover_wins = WIN_SCORE
 
-        for col in range(self.n_cols_board):
+        for col in column_order:
             row = self.is_valid_move(col, board_state)
             if row is None:
                 continue
             else:
-                child_state = np.copy(board_state)
-                child_state[row, col] = player
-                score, throwaway_val, n_nodes = self.minimax(child_state, current_depth + 1, next_player, alpha, beta,
-                                                             n_nodes)
-                column_list.append(col)
-                score_list.append(score)
+                # search the child in place on the same board, then take the move back
+                board_state.play(col, player)
+                child_key = key ^ self.zobrist[player - 1][col * (self.n_rows_board + 1) + row]
+                # the root widens alpha by one so that a move tying the best so far comes back as an exact score
+                # rather than a bound, otherwise the random tie break below could pick a move that is actually worse
+                if current_depth == 0:
+                    child_alpha = alpha - 1
+                else:
+                    child_alpha = alpha
+                score, throwaway_val, n_nodes = self.minimax(board_state, current_depth + 1, next_player,
+                                                             child_alpha, beta, n_nodes, child_key, max_depth)
+                board_state.undo(col, player)
+                if self.out_of_time:
+                    break
+
+                if score == best_score:
+                    best_columns.append(col)
+                elif (is_min_node and score < best_score) or (not is_min_node and score > best_score):
+                    best_score = score
+                    best_columns = [col]
 
                 if is_min_node:
                     beta = min(score, beta)
-                    if beta <= alpha:
-                        if beta == alpha:
-                            score_list[len(score_list) - 1] -= 1
-                        break
                 else:  # is max node
                     alpha = max(score, alpha)
-                    if alpha >= beta:
-                        if alpha == beta:
-                            score_list[len(score_list) - 1] += 1
-                        break
+                if alpha >= beta or score == mover_wins:
+                    if col != killers[0]:
+                        killers[1] = killers[0]
+                        killers[0] = col
+                    break
+
+        if self.out_of_time:
+            return 0, -1, n_nodes
 
         # ensure at least one child had a valid move, if not, just return the evaluation of this node
         # perhaps this could be included in the stop_recursion check for better readability
-        if len(score_list) == 0:
+        if len(best_columns) == 0:
             score = self.evaluate(board_state, self.player)
             return score, -1, n_nodes  # -1 is just a throwaway value
         else:
-            # check for repeat scores
-            if is_min_node:
-                score = min(score_list)
-            else:
-                score = max(score_list)
-            repeats = [score_list[i] for i in range(len(score_list)) if score_list[i] == score]
-            if len(repeats) > 1:
-                repeat_indices = [i for i in range(len(score_list)) if score_list[i] == score]
-                score_idx = np.random.choice(repeat_indices)
-                best_column = column_list[score_idx]
+            score = best_score
+            best_column = random.choice(best_columns)
+
+            # a score outside the original window only bounds the true value of this position
+            if score <= alpha_orig:
+                flag = UPPER
+            elif score >= beta_orig:
+                flag = LOWER
             else:
-                score_idx = score_list.index(score)
-                best_column = column_list[score_idx]
+                flag = EXACT
+            # depth preferred replacement: a shallower result never overwrites a deeper one of the same position, the
+            # deeper search cost more to produce and can answer more lookups
+            if entry is None or entry[0] <= remaining_depth:
+                if len(self.transposition_table) >= TT_SIZE:
+                    self.make_room_in_table()
+                self.transposition_table[key] = (remaining_depth, score, flag, best_column)
 
             return score, best_column, n_nodes
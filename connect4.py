@@ -1,3 +1,4 @@
+import argparse
 import numpy as np
 import Agent
 import pygame
@@ -10,10 +11,11 @@ class Connect4:
 
     Attributes
     ------------
-    board: 2D ndarray representing the game board
+    board: 2D int8 ndarray representing the game board, 0 for open positions or the player number
+    position: Agent.Board - bitboards of the same pieces, used for win detection and handed to the AI agents
     n_rows: integer - number of rows on board. Defaults to 6
     n_cols: integer - number of columns on board. Defaults to 7
-    n_to_win: integer - number of consecutive pieces necessary to win. Defaults to 4. See warning in is_diagonal_win
+    n_to_win: integer - number of consecutive pieces necessary to win. Defaults to 4
     n_positions_remaining: integer - number of open positions remaining on the board
     ai_agent: integer - 0 -> no AI agent, 1 -> Player 1 is an agent, 2 -> Player 2 is an agent, 3 -> Both are agents
     colors: (int, int, int) - tuples representing color rgb values
@@ -22,6 +24,10 @@ class Connect4:
     screen_height: integer - height of GUI
     screen_size: (int, int) - tuple with (screen_width, screen_size) here for convenience with pygame fx calls
     gamepiece_radius: integer - radius of the circular playing pieces
+    column_centers: list of integers - x pixel coordinate of the center of each column
+    row_centers: list of integers - y pixel coordinate on the screen of the center of each row, below the banner
+    banner_rect: (int, int, int, int) - the top banner of the GUI as (left, top, width, height)
+    background: pygame surface object - the empty board, rendered once the GUI is up, None before that
     """
 
     def __init__(self, n_rows=6, n_cols=7, n_to_win=4, ai_agent=0):
@@ -33,7 +39,8 @@ class Connect4:
         :param n_to_win: integer - number of consecutive pieces required for a win
         :param ai_agent: integer - 0 -> no AI agent, 1 -> Player 1 is an AI agent, 2 -> Player 2 is an AI agent
         """
-        self.board = np.zeros((n_rows, n_cols), dtype=int)
+        self.board = np.zeros((n_rows, n_cols), dtype=np.int8)
+        self.position = Agent.Board.from_array(self.board)
         self.n_rows = n_rows
         self.n_cols = n_cols
         self.n_to_win = n_to_win
@@ -48,6 +55,20 @@ class Connect4:
         self.screen_height = self.grid_size * (self.n_rows + 1)
         self.screen_size = (self.screen_width, self.screen_height)
         self.gamepiece_radius = int(0.4 * self.grid_size)
+        self.column_centers = [column * self.grid_size + self.grid_size // 2 for column in range(self.n_cols)]
+        self.row_centers = [(row + 1) * self.grid_size + self.grid_size // 2 for row in range(self.n_rows)]
+        self.banner_rect = (0, 0, self.screen_width, self.grid_size)
+        self.background = None
+
+    def reset(self):
+        """
+        Empties the board for a new game, reusing the existing board and bitboards rather than allocating new ones
+
+        :return: None
+        """
+        self.board.fill(0)
+        self.position.clear()
+        self.n_positions_remaining = self.n_rows * self.n_cols
 
     def is_valid_move(self, row, col):
         """
@@ -59,107 +80,20 @@ class Connect4:
         """
         # must check several items
         # 1 - is the move in the board boundary?
-        # 2 - is the position unoccupied?
-        # 3 - is the position in the bottom row or does it have a piece beneath it if not in the bottom row
+        # 2 - is the position the one just above the pieces already in the column? the bitboard counts them, and that
+        # covers both the position being unoccupied and being in the bottom row or having a piece beneath it
         if row < 0 or col < 0 or row >= self.n_rows or col >= self.n_cols:
             return False
-        elif self.board[row, col] != 0:
-            return False
-        elif row < (self.n_rows - 1) and self.board[row + 1, col] == 0:
-            return False
-        else:
-            return True
-
-    def is_horizontal_win(self, row, player):
-        """
-        Checks if a move in a given row results in a win in the horizontal direction
-
-        :param row: integer - row to check for horizontal win
-        :param player: integer - 1 or 2 representing player 1 or player 2 respectively
-        :return: boolean - True if designated player has won, False otherwise
-        """
-        n_consecutive_pieces = 0
-        for column in range(self.n_cols):
-            if self.board[row, column] == player:
-                n_consecutive_pieces += 1
-                if n_consecutive_pieces == self.n_to_win:
-                    break
-            else:
-                n_consecutive_pieces = 0
-
-        if n_consecutive_pieces == self.n_to_win:
-            return True
-        else:
-            return False
-
-    def is_vertical_win(self, column, player):
-        """
-        Checks if a move in a given column results in a win in the vertical direction
-
-        :param column: integer - column to check for vertical win
-        :param player: integer - 1 or 2 representing player 1 or player 2 respectively
-        :return: boolean - True if designated player has won, False otherwise
-        """
-
-        n_consecutive_pieces = 0
-        for row in range(self.n_rows):
-            if self.board[row, column] == player:
-                n_consecutive_pieces += 1
-                if n_consecutive_pieces == self.n_to_win:
-                    break
-            else:
-                n_consecutive_pieces = 0
-
-        if n_consecutive_pieces >= self.n_to_win:
-            return True
         else:
-            return False
-
-    def is_diagonal_win(self, player):
-        """
-        Brute force check to see if the most recent move results in a win in the diagonal direction
+            return row == self.n_rows - 1 - self.position.heights[col]
 
-        :param player: integer - 1 or 2 representing player 1 or player 2 respectively
-        :return: boolean - True if designated player has won, False otherwise
+    def is_winning_move(self, player):
         """
-
-        # VERY IMPORTANT
-        # NOTE that if self.n_to_win != 4, the hardcoded checks below must also be changed
-        # I couldn't figure out how to do this other than the unfortunate hardcode
-
-        # There is only one way to win diagonally, but two ways to consider it programmatically
-        # 1 - top down - start on the top left side of the board, move down and right checking pieces along the way
-        # 2 - bottom up - start on the left bottom side of the board, move up and right checking pieces along the way
-
-        # top down. recall that the top left position is [0,0]
-        for column in range(self.n_cols - self.n_to_win + 1):
-            for row in range(self.n_rows - self.n_to_win + 1):
-                if self.board[row, column] == self.board[row + 1, column + 1] == self.board[row + 2, column + 2] == \
-                        self.board[row + 3, column + 3] == player:
-                    return True
-
-        # bottom up. recall that the bottom left position is [n_rows-1, 0]
-        for column in range(self.n_cols - self.n_to_win + 1):
-            for row in range(self.n_rows - self.n_to_win + 1, self.n_rows):
-                if self.board[row, column] == self.board[row - 1, column + 1] == self.board[row - 2, column + 2] == \
-                        self.board[row - 3, column + 3] == player:
-                    return True
-
-        # if here, no diagonal wins detected
-        return False
-
-    def is_winning_move(self, row, column, player):
-        """Wrapper function around the horizontal, vertical, and diagonal win functions to check for winning move
-        :param row: integer - row to check for horizontal win
-        :param column: integer - column to check for vertical win
+        Checks the designated player's bitboard for n_to_win consecutive pieces in any direction
         :param player: integer - 1 or 2 representing player 1 or player 2 respectively
         :return: boolean - True if designated player has won, false otherwise
         """
-        if self.is_horizontal_win(row, player) or self.is_vertical_win(column, player) or \
-                self.is_diagonal_win(player):
-            return True
-        else:
-            return False
+        return Agent.is_connected(self.position.pieces(player), self.n_rows + 1, self.n_to_win)
 
     def draw_board(self):
         """
@@ -167,18 +101,28 @@ class Connect4:
 
         :return: None
         """
-        for row in range(self.n_rows):
-            for column in range(self.n_cols):
-                print(self.board[row, column], end=' ')
-            print()
+        # build the whole picture first and print it in one call rather than one print per position
+        lines = [' '.join(str(piece) for piece in row) for row in self.board.tolist()]
+        lines.append(' '.join('^' * self.n_cols))
+        lines.append(' '.join(str(column) for column in range(self.n_cols)))
+        print('\n'.join(lines) + '\n')
 
+    def build_background(self):
+        """
+        Renders the empty board, the blue grid with a gray hole in every position, onto its own surface. It never
+        changes, so it is drawn once and render_gui lays it down with a single blit
+
+        :return: pygame surface object the size of the board area of the GUI, everything below the top banner
+        """
+        background = pygame.Surface((self.screen_width, self.n_rows * self.grid_size))
+        background.fill(self.blue)
         for column in range(self.n_cols):
-            print('^', end=' ')
-        print()
-        for column in range(self.n_cols):
-            print(column, end=' ')
-        print()
-        print()
+            for row in range(self.n_rows):
+                # the background starts below the banner, one grid higher than the screen
+                pygame.draw.circle(background, self.gray,
+                                   (self.column_centers[column], self.row_centers[row] - self.grid_size),
+                                   self.gamepiece_radius)
+        return background
 
     def render_gui(self, screen):
         """
@@ -187,41 +131,48 @@ class Connect4:
         :param screen: pygame surface object representing the GUI screen
         :return: None
         """
-        # go grid by grid, first filling the grid blue, then drawing the correct colored circle to indicate open,
-        # player 1, or player 2
-        # must be done this way to avoid drawing over the top banner where we want the player to be able to move their
-        # piece back and forth and see the movement in real time
+        # lay the empty board down below the top banner, where we want the player to be able to move their piece
+        # back and forth and see the movement in real time, then draw only the positions that hold a piece
+        screen.blit(self.background, (0, self.grid_size))
 
-        for column in range(self.n_cols):
-            for row in range(self.n_rows):
-                pygame.draw.rect(screen, self.blue, (column * self.grid_size, (row + 1) * self.grid_size,
-                                                     self.grid_size, self.grid_size))
-                if self.board[row, column] == 0:
-                    pygame.draw.circle(screen, self.gray, ((column + 1) * self.grid_size - self.grid_size / 2,
-                                                           (row + 2) * self.grid_size - self.grid_size / 2),
-                                       self.gamepiece_radius)
-                elif self.board[row, column] == 1:
-                    pygame.draw.circle(screen, self.red, ((column + 1) * self.grid_size - self.grid_size / 2,
-                                                          (row + 2) * self.grid_size - self.grid_size / 2),
-                                       self.gamepiece_radius)
-                else:  # piece belongs to player 2
-                    pygame.draw.circle(screen, self.yellow, ((column + 1) * self.grid_size - self.grid_size / 2,
-                                                             (row + 2) * self.grid_size - self.grid_size / 2),
-                                       self.gamepiece_radius)
+        for row, column in zip(*np.nonzero(self.board)):
+            if self.board[row, column] == 1:
+                color = self.red
+            else:  # piece belongs to player 2
+                color = self.yellow
+            pygame.draw.circle(screen, color, (self.column_centers[column], self.row_centers[row]),
+                               self.gamepiece_radius)
 
         pygame.display.update()
 
+    def draw_piece(self, screen, row, column):
+        """
+        Draws the piece just played at board[row, column]. Nothing else on the board changes with a move, so only the
+        grid it sits in needs to go to the display
+
+        :param screen: pygame surface object representing the GUI screen
+        :param row: integer - row of the piece
+        :param column: integer - column of the piece
+        :return: (int, int, int, int) - rect of the grid that was drawn, to pass to pygame.display.update
+        """
+        if self.board[row, column] == 1:
+            color = self.red
+        else:  # piece belongs to player 2
+            color = self.yellow
+        pygame.draw.circle(screen, color, (self.column_centers[column], self.row_centers[row]), self.gamepiece_radius)
+        return column * self.grid_size, (row + 1) * self.grid_size, self.grid_size, self.grid_size
+
     def get_row(self, column):
         """
         Finds the bottom most open row in a given column, or returns -1 if the column is full
         :param column: column selected by player or agent
         :return: bottom most open row if a position in the requested column is available, -1 otherwise
         """
+        # the bitboard tracks how many pieces each column holds, the next one lands just above them. recall that row
+        # n_rows - 1 is the bottom row
         rv = -1
-        for row in range(self.n_rows - 1, -1, -1):  # search bottom to top
-            if self.is_valid_move(row, column):
-                rv = row
-                break
+        if 0 <= column < self.n_cols and self.position.heights[column] < self.n_rows:
+            rv = self.n_rows - 1 - self.position.heights[column]
 
         return rv
 
@@ -234,8 +185,25 @@ class Connect4:
         :return: None
         """
         self.board[row, column] = player
+        self.position.play(column, player)
         self.n_positions_remaining -= 1
 
+    def step(self, column, player):
+        """
+        Plays a single move, leaving out everything to do with the GUI so that games can also be driven, and timed,
+        without pygame
+
+        :param column: integer - column selected by player or agent
+        :param player: integer - 1 or 2 representing player 1 or player 2 respectively
+        :return: (row, won) - row the piece landed in or -1 if the column is full and nothing was played, and True if
+            the move won the game for the player
+        """
+        row = self.get_row(column)
+        if row == -1:
+            return row, False
+        self.execute_move(row, column, player)
+        return row, self.is_winning_move(player)
+
     def play(self):
         """
         Plays Connect4 via the terminal
@@ -247,18 +215,24 @@ class Connect4:
         pygame.init()
         player = 1
         if self.ai_agent == 3:  # two AI players
-            agent1 = Agent.Agent(1)
-            agent2 = Agent.Agent(2)
-        else:
-            ai_opponent = Agent.Agent(self.ai_agent)
+            agent1 = Agent.Agent(1, self.n_rows, self.n_cols, self.n_to_win)
+            agent2 = Agent.Agent(2, self.n_rows, self.n_cols, self.n_to_win)
+        elif self.ai_agent != 0:  # one AI player, two humans need no agent and can play on any size of board
+            ai_opponent = Agent.Agent(self.ai_agent, self.n_rows, self.n_cols, self.n_to_win)
         n_max_nodes = 0
         running = True
         screen = pygame.display.set_mode(self.screen_size)
         screen.fill(self.gray)  # screen defaults to black, fill it in with gray
+        self.background = self.build_background()
         self.render_gui(screen)  # initialize gui with all empty positions
         pygame.display.set_caption("Connect4")
         pygame.display.update()
         font = pygame.font.SysFont('calibri', 50)
+        if self.ai_agent == 3:
+            # no one can click in a game between two agents, the only event that matters is closing the window. all
+            # others are kept off the queue so it can never fill up and drop that one
+            pygame.event.set_blocked(None)
+            pygame.event.set_allowed(pygame.QUIT)
         print('Pygame module initialization complete')
         print()
 
@@ -266,7 +240,7 @@ class Connect4:
             if self.n_positions_remaining == 0:
                 banner_text = font.render("Draw - No Winners Here", True, self.blue)
                 screen.blit(banner_text, (25, 25))
-                pygame.display.update()
+                pygame.display.update(self.banner_rect)
                 break
 
             if player == 1:
@@ -274,33 +248,40 @@ class Connect4:
             else:
                 color = self.yellow
 
-            for event in pygame.event.get():
+            # the mouse can move many times between frames, but only the last position matters since the piece would
+            # be drawn over again straight away, so the banner is redrawn and pushed to the display once per batch
+            if self.ai_agent == 3:
+                # between two agents there is nothing to handle but a quit, peek for it rather than draining the queue
+                if pygame.event.peek(pygame.QUIT):
+                    sys.exit()
+                events = []
+            else:
+                events = pygame.event.get()
+            motions = [event for event in events if event.type == pygame.MOUSEMOTION]
+            if motions:
+                pygame.draw.rect(screen, self.gray, self.banner_rect)  # gray out banner
+                x_pos_mouse_ptr = motions[-1].pos[0]
+                if self.ai_agent != 3 and player != self.ai_agent:
+                    pygame.draw.circle(screen, color, (x_pos_mouse_ptr, self.grid_size // 2), self.gamepiece_radius)
+                pygame.display.update(self.banner_rect)
+
+            for event in events:
                 if event.type == pygame.QUIT:
                     sys.exit()
 
-                if event.type == pygame.MOUSEMOTION:
-                    pygame.draw.rect(screen, self.gray, (0, 0, self.screen_width, self.grid_size))  # gray out banner
-                    x_pos_mouse_ptr = event.pos[0]
-                    if self.ai_agent != 3 and player != self.ai_agent:
-                        pygame.draw.circle(screen, color, (x_pos_mouse_ptr, self.grid_size // 2), self.gamepiece_radius)
-
-                pygame.display.update()
-
                 if event.type == pygame.MOUSEBUTTONDOWN:
-                    pygame.draw.rect(screen, self.gray, (0, 0, self.screen_width, self.grid_size))  # gray out banner
+                    pygame.draw.rect(screen, self.gray, self.banner_rect)  # gray out banner
 
                     # if there is at least one human player and it is currently the human player's turn
                     if self.ai_agent != 3 and player != self.ai_agent:
                         x_pos_mouse_ptr = event.pos[0]
                         column = x_pos_mouse_ptr // self.grid_size  # integer division
-                        row = self.get_row(column)
+                        row, won = self.step(column, player)
 
                         if row == -1:  # if invalid move
                             break
-                        else:
-                            self.execute_move(row, column, player)
 
-                        if self.is_winning_move(row, column, player):
+                        if won:
 
                             # if there is an agent playing, mock them for losing, even though they don't feel anything
                             if self.ai_agent != 0:
@@ -318,21 +299,20 @@ class Connect4:
                                 player = 1
 
                         self.draw_board()
-                        self.render_gui(screen)
+                        pygame.display.update([self.banner_rect, self.draw_piece(screen, row, column)])
 
             # note that this is outside the event loop, but still in the while running loop
             if self.ai_agent == 3 or self.ai_agent == player:
                 # if both players are ai agents
                 if self.ai_agent == 3:
                     if player == 1:
-                        score, column, n_nodes = agent1.minimax(self.board, 0, 1, -np.inf, np.inf, 0)
+                        score, column, n_nodes = agent1.choose_move(self.position)
                     else:  # player = 2
-                        score, column, n_nodes = agent2.minimax(self.board, 0, 2, -np.inf, np.inf, 0)
+                        score, column, n_nodes = agent2.choose_move(self.position)
                 else:
-                    score, column, n_nodes = ai_opponent.minimax(self.board, 0, self.ai_agent, -np.inf, np.inf, 0)
+                    score, column, n_nodes = ai_opponent.choose_move(self.position)
                 n_max_nodes = max(n_nodes, n_max_nodes)
-                row = self.get_row(column)
-                self.execute_move(row, column, player)
+                row, won = self.step(column, player)
                 print("Player ", player, "'s move = column ", column, "    score = ", score, sep='')
                 print(n_nodes, "nodes visited")
                 print()
@@ -342,7 +322,7 @@ class Connect4:
                                    str(score) + '\n')
                     file_obj.write("Nodes visited = " + str(n_nodes) + '\n')
 
-                if self.is_winning_move(row, column, player):
+                if won:
 
                     # if there is a human player, mock them
                     if self.ai_agent != 3:
@@ -360,7 +340,7 @@ class Connect4:
                         player = 1
 
                 self.draw_board()
-                self.render_gui(screen)
+                pygame.display.update([self.banner_rect, self.draw_piece(screen, row, column)])
 
         # when the game is over, delay before closing the screen, then exit
         print("Max nodes visited in a turn: ", n_max_nodes)
@@ -371,5 +351,22 @@ class Connect4:
         sys.exit()
 
 
-game = Connect4(ai_agent=2)
-game.play()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play Connect4 against a human or an AI agent")
+    parser.add_argument('--rows', type=int, default=6, help="number of rows on the board")
+    parser.add_argument('--cols', type=int, default=7, help="number of columns on the board")
+    parser.add_argument('--to-win', type=int, default=4, help="number of consecutive pieces required for a win")
+    parser.add_argument('--ai-agent', type=int, default=2, choices=[0, 1, 2, 3],
+                        help="0 -> no AI agent, 1 or 2 -> that player is an AI agent, 3 -> both are")
+    args = parser.parse_args()
+    if args.rows < 1 or args.cols < 1:
+        parser.error("the board needs at least one row and one column")
+    if args.to_win < 2:
+        parser.error("--to-win must be at least 2, otherwise any single piece wins")
+    # the agents search on 64 bit bitboards, which take n_rows + 1 bits per column
+    if args.ai_agent != 0 and args.cols * (args.rows + 1) > 64:
+        parser.error("a %dx%d board is too large for the AI agent, cols * (rows + 1) must be at most 64"
+                     % (args.rows, args.cols))
+
+    game = Connect4(n_rows=args.rows, n_cols=args.cols, n_to_win=args.to_win, ai_agent=args.ai_agent)
+    game.play()
@@ -0,0 +1,130 @@
+import importlib.util
+import random
+import unittest
+
+import numpy as np
+
+import Agent
+
+# (n_rows, n_cols, n_to_win) of the boards checked, all small enough for the agent's 64 bit bitboards
+SHAPES = [(6, 7, 4), (5, 6, 4), (6, 7, 3), (4, 4, 3), (7, 8, 5), (8, 7, 4)]
+
+# random games played on each shape
+N_GAMES = 50
+
+
+def brute_force_win(board, player, n_to_win):
+    """
+    Reference win check: walks every row, column and diagonal of the 2D array looking for n_to_win in a row
+
+    :param board: 2D NumPy array, 0 for open positions or the player number, row 0 is the top row
+    :param player: integer - 1 or 2
+    :param n_to_win: number of consecutive pieces required for a win
+    :return: True if the designated player has n_to_win in a row, False otherwise
+    """
+    n_rows, n_cols = board.shape
+    for row in range(n_rows):
+        for col in range(n_cols):
+            for d_row, d_col in ((0, 1), (1, 0), (1, 1), (-1, 1)):
+                last_row = row + (n_to_win - 1) * d_row
+                last_col = col + (n_to_win - 1) * d_col
+                if not (0 <= last_row < n_rows and last_col < n_cols):
+                    continue
+                if all(board[row + i * d_row, col + i * d_col] == player for i in range(n_to_win)):
+                    return True
+    return False
+
+
+def brute_force_row(board, col):
+    """
+    Reference landing row: the bottom most open row of the column, found by scanning the array
+
+    :return: row the next piece in the column lands in, -1 if the column is full
+    """
+    for row in range(board.shape[0] - 1, -1, -1):
+        if board[row, col] == 0:
+            return row
+    return -1
+
+
+def random_games(n_rows, n_cols, seed):
+    """
+    Plays random games to a full board, yielding after every move so the bitboards can be checked against the array.
+    Games carry on past a win so positions where both players have a streak are covered too
+
+    :return: generator of (board, position, player) - the 2D array, the Board kept in step with it, and the player
+        who just moved
+    """
+    rng = random.Random(seed)
+    for game in range(N_GAMES):
+        board = np.zeros((n_rows, n_cols), dtype=np.int8)
+        position = Agent.Board.from_array(board)
+        player = 1
+        while position.n_open > 0:
+            col = rng.choice([col for col in range(n_cols) if board[0, col] == 0])
+            board[brute_force_row(board, col), col] = player
+            position.play(col, player)
+            yield board, position, player
+            player = 3 - player
+
+
+class TestAgentBitboards(unittest.TestCase):
+
+    def test_is_connected_matches_brute_force(self):
+        for n_rows, n_cols, n_to_win in SHAPES:
+            agent = Agent.Agent(1, n_rows, n_cols, n_to_win)
+            for board, position, player in random_games(n_rows, n_cols, seed=n_rows * 100 + n_cols):
+                for who in (1, 2):
+                    expected = brute_force_win(board, who, n_to_win)
+                    self.assertEqual(Agent.is_connected(position.pieces(who), n_rows + 1, n_to_win), expected)
+                    self.assertEqual(agent.is_winning_state(position, who), expected)
+
+    def test_winning_moves_matches_brute_force(self):
+        for n_rows, n_cols, n_to_win in SHAPES:
+            agent = Agent.Agent(1, n_rows, n_cols, n_to_win)
+            for board, position, player in random_games(n_rows, n_cols, seed=n_rows * 100 + n_cols + 1):
+                for who in (1, 2):
+                    # the search never asks once a player has already won, and then every move would count
+                    if brute_force_win(board, who, n_to_win):
+                        continue
+                    expected = []
+                    for col in range(n_cols):
+                        row = brute_force_row(board, col)
+                        if row != -1:
+                            board[row, col] = who
+                            if brute_force_win(board, who, n_to_win):
+                                expected.append(col)
+                            board[row, col] = 0
+                    self.assertEqual(sorted(agent.winning_moves(position, who)), expected)
+
+    def test_from_array_matches_played_board(self):
+        for n_rows, n_cols, n_to_win in SHAPES:
+            for board, position, player in random_games(n_rows, n_cols, seed=n_rows * 100 + n_cols + 2):
+                self.assertEqual(Agent.Board.from_array(board), position)
+
+
+@unittest.skipIf(importlib.util.find_spec('pygame') is None, "connect4 needs pygame")
+class TestConnect4Bitboards(unittest.TestCase):
+
+    def test_moves_and_wins_match_brute_force(self):
+        import connect4
+
+        for n_rows, n_cols, n_to_win in SHAPES:
+            rng = random.Random(n_rows * 100 + n_cols + 3)
+            for game_number in range(N_GAMES):
+                game = connect4.Connect4(n_rows, n_cols, n_to_win)
+                player = 1
+                while game.n_positions_remaining > 0:
+                    for col in range(-1, n_cols + 1):
+                        expected_row = -1
+                        if 0 <= col < n_cols:
+                            expected_row = brute_force_row(game.board, col)
+                        self.assertEqual(game.get_row(col), expected_row)
+                        for row in range(-1, n_rows + 1):
+                            self.assertEqual(game.is_valid_move(row, col), row != -1 and row == expected_row)
+                    col = rng.choice([col for col in range(n_cols) if game.get_row(col) != -1])
+                    row, won = game.step(col, player)
+                    self.assertEqual(won, brute_force_win(game.board, player, n_to_win))
+                    if won:
+                        break
+                    player = 3 - player
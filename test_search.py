@@ -0,0 +1,136 @@
+import random
+import time
+import unittest
+from unittest import mock
+
+import Agent
+
+# depth of the searches checked against the reference, deep enough for the aspiration windows and killers to kick in
+DEPTH = 4
+
+# (n_rows, n_cols) of the boards checked, with 4 to win
+SHAPES = [(6, 7), (5, 6)]
+
+
+def reference_minimax(agent, board, current_depth, player, max_depth):
+    """
+    Reference search: plain minimax over every child with no pruning, table or move ordering, scored the same way as
+    Agent.minimax
+
+    :param agent: Agent whose point of view the scores are from
+    :param board: Board to search, restored before returning
+    :param current_depth: depth of this node, the agent moves at even depths
+    :param player: integer - player to move
+    :param max_depth: depth at which positions are evaluated
+    :return: minimax score of the board
+    """
+    last_player = agent.opponent_of[player]
+    if agent.is_winning_state(board, last_player):
+        if last_player == agent.player:
+            return Agent.WIN_SCORE
+        return -Agent.WIN_SCORE
+    if board.n_open == 0:
+        return 0
+    if current_depth == max_depth:
+        return agent.evaluate(board, agent.player)
+    scores = []
+    for col in range(len(board.heights)):
+        if board.heights[col] < board.n_rows:
+            board.play(col, player)
+            scores.append(reference_minimax(agent, board, current_depth + 1, agent.opponent_of[player], max_depth))
+            board.undo(col, player)
+    if player == agent.player:
+        return max(scores)
+    return min(scores)
+
+
+def reference_root_scores(agent, board, max_depth):
+    """
+    :return: dict - column -> reference score of playing the agent's piece there
+    """
+    scores = {}
+    for col in range(len(board.heights)):
+        if board.heights[col] < board.n_rows:
+            board.play(col, agent.player)
+            scores[col] = reference_minimax(agent, board, 1, agent.opponent_of[agent.player], max_depth)
+            board.undo(col, agent.player)
+    return scores
+
+
+def snapshot(board):
+    """
+    :return: independent copy of the Board to compare against after a search
+    """
+    return Agent.Board(board.p1, board.p2, list(board.heights), board.n_rows, board.n_open)
+
+
+def random_position(n_rows, n_cols, n_moves, rng):
+    """
+    Plays n_moves random moves, stopping early rather than reaching a finished game
+
+    :return: (board, player) - the Board and the player to move on it
+    """
+    board = Agent.Board(0, 0, [0] * n_cols, n_rows, n_rows * n_cols)
+    agent = Agent.Agent(1, n_rows, n_cols)
+    player = 1
+    for move in range(n_moves):
+        col = rng.choice([col for col in range(n_cols) if board.heights[col] < n_rows])
+        board.play(col, player)
+        if agent.is_winning_state(board, player) or board.n_open == 0:
+            board.undo(col, player)
+            break
+        player = 3 - player
+    return board, player
+
+
+class TestChooseMove(unittest.TestCase):
+
+    def assert_matches_reference(self, agent, board):
+        before = snapshot(board)
+        score, column, n_nodes = agent.choose_move(board, max_depth=DEPTH)
+        self.assertEqual(board, before)
+        expected = reference_root_scores(agent, board, DEPTH)
+        self.assertEqual(score, max(expected.values()))
+        self.assertEqual(expected[column], score)
+
+    def test_matches_unpruned_minimax(self):
+        for n_rows, n_cols in SHAPES:
+            rng = random.Random(n_rows * 100 + n_cols)
+            for position_number in range(6):
+                board, player = random_position(n_rows, n_cols, rng.randint(0, 16), rng)
+                self.assert_matches_reference(Agent.Agent(player, n_rows, n_cols), board)
+
+    def test_matches_unpruned_minimax_with_agents_reused_across_a_game(self):
+        for n_rows, n_cols in SHAPES:
+            agents = {1: Agent.Agent(1, n_rows, n_cols), 2: Agent.Agent(2, n_rows, n_cols)}
+            board = Agent.Board(0, 0, [0] * n_cols, n_rows, n_rows * n_cols)
+            player = 1
+            while board.n_open > 0:
+                self.assert_matches_reference(agents[player], board)
+                score, column, n_nodes = agents[player].choose_move(board, max_depth=DEPTH)
+                board.play(column, player)
+                if agents[player].is_winning_state(board, player):
+                    break
+                player = 3 - player
+
+    def test_matches_unpruned_minimax_with_evictions(self):
+        # a small table fills up within a few moves, so positions are searched right after entries were evicted. the
+        # positions get longer like they would over a game, so the table never holds a deeper result than asked for
+        with mock.patch.object(Agent, 'TT_SIZE', 40), mock.patch.object(Agent, 'TT_LOW_WATER', 30):
+            agent = Agent.Agent(1)
+            rng = random.Random(3)
+            for n_moves in sorted(2 * rng.randint(0, 8) for position_number in range(6)):
+                board, player = random_position(6, 7, n_moves, rng)
+                self.assert_matches_reference(agent, board)
+                self.assertLessEqual(len(agent.transposition_table), 40)
+
+    def test_time_budget_abandons_iteration(self):
+        agent = Agent.Agent(1)
+        board, player = random_position(6, 7, 4, random.Random(5))
+        before = snapshot(board)
+        start = time.monotonic()
+        score, column, n_nodes = agent.choose_move(board, time_budget=0.02, max_depth=20)
+        self.assertLess(time.monotonic() - start, 2)  # a full depth 20 search would take far longer
+        self.assertEqual(board, before)
+        self.assertTrue(0 <= column < 7 and board.heights[column] < 6)
+        self.assertIsNone(agent.deadline)